@@ -1,12 +1,27 @@
 # routes/summarizer.py
-from fastapi import APIRouter, UploadFile, File
-import os, shutil, traceback
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+import asyncio, json, os, tempfile, threading, traceback
+from concurrent.futures import Future
+from typing import Dict, List, Optional
 
 from utils.extract_text import extract_text_from_file
 from utils.openai_utils import generate_summary_flashcards_quiz
+from utils.retrieval import cache_text, document_hash, get_text
 
 router = APIRouter()
 
+# Max LLM round trips in flight across all summarize requests
+LLM_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "12"))
+# Uploads are copied into memory for the whole batch, so cap how many one request can send
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "12"))
+_llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+
+# doc_id -> Future[str] for extractions currently running, so concurrent requests
+# for the same bytes (single, batch, follow-up) share one extraction
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
 def _force_string(value) -> str:
     """Coerce any extractor/AI return payload to a text string safely."""
     if value is None:
@@ -123,48 +138,143 @@ def _normalize_quiz(items):
 
     return out
 
-@router.post("/summarize/")
-async def summarize_file(file: UploadFile = File(...)):
+def _extract_to_text(filename: str, content: bytes) -> str:
     os.makedirs("temp", exist_ok=True)
-    file_path = os.path.join("temp", file.filename)
-
+    ext = os.path.splitext(filename)[-1].lower()
+    # Unique file per call; concurrent uploads with the same name must not share a path
+    fd, file_path = tempfile.mkstemp(suffix=ext, dir="temp")
     try:
         # Save upload to disk
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
 
-        ext = os.path.splitext(file_path)[-1].lower()
-        print(f"[SUMMARIZER] Received file: {file.filename} ext={ext} path={file_path}")
+        print(f"[SUMMARIZER] ext={ext} path={file_path}")
 
         # Extract text (coerce to safe string)
         raw_text = extract_text_from_file(file_path)
         text = _force_string(raw_text).strip()
         if not text:
-            return {"success": False, "error": "The document appears to be empty or unreadable."}
+            raise ValueError("The document appears to be empty or unreadable.")
 
         print(f"[SUMMARIZER] Extracted text length: {len(text)}")
+        return text
+    finally:
+        # Best-effort cleanup
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception:
+            pass
+
+def _extract_upload(filename: str, content: bytes, doc_id: str) -> str:
+    """
+    Return the document text for an upload, reusing the cached text when the same
+    bytes were seen recently and joining an extraction already running for them.
+    Raises ValueError for unsupported/unreadable files. Blocking; call via to_thread.
+    """
+    # Same bytes seen recently -> reuse the extracted text
+    cached = get_text(doc_id)
+    if cached is not None:
+        print(f"[SUMMARIZER] Cache hit for {filename}, skipping extraction")
+        return cached
+
+    with _inflight_lock:
+        future = _inflight.get(doc_id)
+        if future is None:
+            # An owner may have cached the text and left _inflight since our first check
+            cached = get_text(doc_id)
+            if cached is not None:
+                return cached
+        owner = future is None
+        if owner:
+            future = _inflight[doc_id] = Future()
+
+    if not owner:
+        print(f"[SUMMARIZER] Joining in-flight extraction for {filename}")
+        return future.result()
+
+    try:
+        text = _extract_to_text(filename, content)
+        cache_text(doc_id, text)
+        future.set_result(text)
+        return text
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(doc_id, None)
+
+def _cached_or_inflight_text(doc_id: str) -> Optional[str]:
+    """Cached text for doc_id, waiting for a running extraction if there is one."""
+    text = get_text(doc_id)
+    if text is not None:
+        return text
+    with _inflight_lock:
+        future = _inflight.get(doc_id)
+    if future is None:
+        return None
+    try:
+        return future.result()
+    except Exception:
+        return None
+
+async def _generate(text: str, topic: Optional[str], doc_id: str):
+    """
+    Run the blocking OpenAI call in a worker thread under the shared _llm_slots limit.
+    Threads can't be cancelled, so if the caller is cancelled (client disconnected)
+    the slot stays held until the thread's call actually returns.
+    """
+    async with _llm_slots:
+        call = asyncio.ensure_future(
+            asyncio.to_thread(generate_summary_flashcards_quiz, text, topic=topic, doc_id=doc_id)
+        )
+        try:
+            return await asyncio.shield(call)
+        except asyncio.CancelledError:
+            while not call.done():
+                try:
+                    await asyncio.wait({call})
+                except asyncio.CancelledError:
+                    pass
+            raise
+
+def _build_response(ai_out, doc_id: str):
+    """Normalize generator output into the payload the frontend expects."""
+    if not isinstance(ai_out, dict):
+        return {"success": False, "error": "OpenAI returned an unexpected format."}
+
+    # Normalize output so frontend always gets what it expects
+    summary    = _force_string(ai_out.get("summary")).strip()
+    flashcards = _normalize_flashcards(ai_out.get("flashcards"))
+    quiz       = _normalize_quiz(ai_out.get("quiz"))
+
+    if not summary:
+        return {"success": False, "error": "Summary generation returned empty text."}
+
+    return {
+        "success": True,
+        "data": {
+            "documentId": doc_id,
+            "summary": summary,
+            "flashcards": flashcards,
+            "quiz": quiz,
+        },
+    }
+
+@router.post("/summarize/")
+async def summarize_file(file: UploadFile = File(...), topic: Optional[str] = Form(None)):
+    try:
+        content = await file.read()
+        doc_id = document_hash(content)
+        print(f"[SUMMARIZER] Received file: {file.filename} doc_id={doc_id[:12]} topic={topic!r}")
+
+        # Run blocking extraction/OpenAI calls off the event loop
+        text = await asyncio.to_thread(_extract_upload, file.filename, content, doc_id)
 
         # Generate summary + study aids
-        ai_out = generate_summary_flashcards_quiz(text)
-        if not isinstance(ai_out, dict):
-            return {"success": False, "error": "OpenAI returned an unexpected format."}
-
-        # Normalize output so frontend always gets what it expects
-        summary    = _force_string(ai_out.get("summary")).strip()
-        flashcards = _normalize_flashcards(ai_out.get("flashcards"))
-        quiz       = _normalize_quiz(ai_out.get("quiz"))
-
-        if not summary:
-            return {"success": False, "error": "Summary generation returned empty text."}
-
-        return {
-            "success": True,
-            "data": {
-                "summary": summary,
-                "flashcards": flashcards,
-                "quiz": quiz,
-            },
-        }
+        ai_out = await _generate(text, topic, doc_id)
+        return _build_response(ai_out, doc_id)
 
     except ValueError as ve:
         msg = str(ve)
@@ -176,10 +286,80 @@ async def summarize_file(file: UploadFile = File(...)):
         traceback.print_exc()
         return {"success": False, "error": "Summarization failed on the server. Check backend logs for details."}
 
-    finally:
-        # Best-effort cleanup
+@router.post("/summarize/followup")
+async def summarize_followup(documentId: str = Form(...), topic: str = Form(...)):
+    """Answer a targeted request against a previously uploaded document without re-extracting it."""
+    try:
+        text = await asyncio.to_thread(_cached_or_inflight_text, documentId)
+        if text is None:
+            return {"success": False, "error": "Document is no longer cached. Please upload it again."}
+        if not topic.strip():
+            return {"success": False, "error": "Please provide a topic or question."}
+
+        print(f"[SUMMARIZER] Follow-up doc_id={documentId[:12]} topic={topic!r}")
+        ai_out = await _generate(text, topic, documentId)
+        return _build_response(ai_out, documentId)
+
+    except Exception as e:
+        print("[SUMMARIZER][Exception]", e)
+        traceback.print_exc()
+        return {"success": False, "error": "Summarization failed on the server. Check backend logs for details."}
+
+@router.post("/summarize/batch")
+async def summarize_batch(files: List[UploadFile] = File(...), topic: Optional[str] = Form(None)):
+    """
+    Summarize many files in one request. Identical files (by content hash) are processed
+    once; extraction runs in worker threads and LLM calls share the process-wide
+    OPENAI_MAX_CONCURRENCY limit. N unique files take about ceil(N / limit) rounds of
+    the slowest file (each round may include the summary "expand" pass), so a batch
+    within the limit and with no other traffic finishes in about its slowest file's time.
+    More than MAX_BATCH_FILES files is rejected with HTTP 413. The multipart body has
+    already been parsed and spooled by then; the cap only bounds what the batch copies
+    into memory and how much work it schedules.
+    Streams one NDJSON line per uploaded file as soon as its result is ready:
+      {"filename": str, "index": int, "success": bool, "data"?: {...}, "error"?: str}
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files: upload at most {MAX_BATCH_FILES} per batch.")
+
+    # Read uploads up front; the request body is gone once we start streaming
+    uploads = []
+    for i, f in enumerate(files):
+        content = await f.read()
+        uploads.append((i, f.filename, content, document_hash(content)))
+
+    # Group duplicate uploads under one job
+    jobs = {}
+    for i, filename, content, doc_id in uploads:
+        jobs.setdefault(doc_id, {"filename": filename, "content": content, "targets": []})
+        jobs[doc_id]["targets"].append((i, filename))
+    print(f"[SUMMARIZER] Batch: {len(uploads)} files, {len(jobs)} unique, topic={topic!r}")
+
+    async def run_job(doc_id, job):
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception:
-            pass
+            text = await asyncio.to_thread(_extract_upload, job["filename"], job["content"], doc_id)
+            ai_out = await _generate(text, topic, doc_id)
+            result = _build_response(ai_out, doc_id)
+        except ValueError as ve:
+            print(f"[SUMMARIZER][ValueError] {job['filename']}: {ve}")
+            result = {"success": False, "error": str(ve)}
+        except Exception as e:
+            print(f"[SUMMARIZER][Exception] {job['filename']}:", e)
+            traceback.print_exc()
+            result = {"success": False, "error": "Summarization failed on the server. Check backend logs for details."}
+        return job["targets"], result
+
+    async def stream():
+        tasks = [asyncio.create_task(run_job(doc_id, job)) for doc_id, job in jobs.items()]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                targets, result = await next_done
+                for i, filename in targets:
+                    yield json.dumps({"filename": filename, "index": i, **result}) + "\n"
+        finally:
+            # Client went away mid-stream: stop jobs that haven't reached OpenAI yet.
+            # Calls already running finish in their threads and keep their slot until then.
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
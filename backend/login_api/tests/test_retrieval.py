@@ -0,0 +1,59 @@
+# tests/test_retrieval.py
+from utils.retrieval import CHARS_PER_TOKEN, DocumentIndex, _split_segments, _tokenize
+
+
+def test_tokenize_drops_stopwords_and_folds_plurals():
+    assert _tokenize("Quiz me on the Schedulers") == ["scheduler"]
+    assert _tokenize("process") == ["process"]  # "ss" ending is not a plural
+
+
+def test_long_line_is_hard_wrapped_within_max_chars():
+    text = "x" * 2500
+    segments = _split_segments(text, max_chars=800)
+    assert all(len(s) <= 800 for s in segments)
+    assert "".join(segments) == text
+
+
+def test_segments_flush_on_blank_lines_and_keep_order():
+    blocks = [f"block {i} " + "word " * 50 for i in range(5)]
+    segments = _split_segments("\n\n".join(blocks), max_chars=300)
+    assert all(len(s) <= 300 for s in segments)
+    joined = "\n".join(segments)
+    positions = [joined.index(f"block {i} ") for i in range(5)]
+    assert positions == sorted(positions)
+
+
+def test_short_lines_are_packed_together():
+    text = "\n".join(f"bullet {i}" for i in range(10))
+    assert _split_segments(text, max_chars=800) == [text]
+
+
+def _deck():
+    filler = [f"Topic {i}: cpu scheduling burst queue dispatcher latency " * 6 for i in range(40)]
+    filler.insert(20, "Round-robin scheduling gives each process a time quantum, then preempts it.")
+    return "\n\n".join(filler)
+
+
+def test_select_returns_relevant_passage_and_skips_common_term_matches():
+    index = DocumentIndex.build("doc", _deck())
+    out = index.select("quiz me on round-robin scheduling", token_budget=1500)
+    assert "Round-robin" in out
+    # "scheduling" appears in every segment; the cutoff keeps those out
+    assert "Topic 5:" not in out
+
+
+def test_select_respects_budget_and_document_order():
+    index = DocumentIndex.build("doc", _deck())
+    budget = 500
+    out = index.select("cpu scheduling topic", token_budget=budget, top_k=100, min_score_ratio=0)
+    assert 0 < len(out) <= budget * CHARS_PER_TOKEN
+    picked = out.split("\n\n")
+    assert len(picked) > 1
+    first_topics = [int(seg.split(":")[0].split()[1]) for seg in picked]
+    assert first_topics == sorted(first_topics)
+
+
+def test_select_falls_back_to_document_head_when_nothing_matches():
+    text = _deck()
+    index = DocumentIndex.build("doc", text)
+    assert index.select("photosynthesis", token_budget=50) == text[: 50 * CHARS_PER_TOKEN]
@@ -0,0 +1,147 @@
+# tests/test_summarizer_batch.py
+import asyncio
+import io
+import json
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+# openai_utils builds its client at import time
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+from fastapi import HTTPException, UploadFile
+
+import routes.summarizer as summarizer
+from utils.retrieval import document_hash
+
+
+@pytest.fixture
+def calls(monkeypatch, tmp_path):
+    """Stub out extraction and OpenAI, recording every call."""
+    monkeypatch.chdir(tmp_path)
+    log = {"extract": [], "generate": []}
+    lock = threading.Lock()
+
+    def fake_extract(path):
+        with open(path, "rb") as f:
+            data = f.read().decode()
+        if path.endswith(".doc"):
+            raise ValueError("Legacy Office format (.doc/.ppt) is not supported.")
+        time.sleep(0.05)
+        with lock:
+            log["extract"].append(data)
+        return data
+
+    def fake_generate(text, topic=None, doc_id=None):
+        with lock:
+            log["generate"].append(text)
+        return {"summary": f"summary of {text}", "flashcards": [], "quiz": []}
+
+    monkeypatch.setattr(summarizer, "extract_text_from_file", fake_extract)
+    monkeypatch.setattr(summarizer, "generate_summary_flashcards_quiz", fake_generate)
+    return log
+
+
+def _upload(name, content: bytes):
+    return UploadFile(file=io.BytesIO(content), filename=name)
+
+
+def _unique(label: str) -> bytes:
+    # Fresh bytes per test so the module-level text cache never short-circuits
+    return f"{label} {uuid.uuid4()}".encode()
+
+
+async def _run_batch(files, topic=None):
+    response = await summarizer.summarize_batch(files, topic=topic)
+    lines = [chunk async for chunk in response.body_iterator]
+    return [json.loads(line) for line in "".join(lines).splitlines()]
+
+
+def test_batch_dedupes_identical_files_and_reports_every_upload(calls):
+    alpha, beta = _unique("alpha"), _unique("beta")
+    files = [_upload("a.txt", alpha), _upload("b.txt", beta), _upload("a-copy.txt", alpha)]
+
+    results = asyncio.run(_run_batch(files))
+
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+    assert all(r["success"] for r in results)
+    by_index = {r["index"]: r for r in results}
+    assert by_index[0]["data"] == by_index[2]["data"]
+    assert by_index[2]["filename"] == "a-copy.txt"
+    assert sorted(calls["extract"]) == sorted([alpha.decode(), beta.decode()])
+    assert sorted(calls["generate"]) == sorted([alpha.decode(), beta.decode()])
+
+
+def test_batch_reports_errors_per_file(calls):
+    ok = _unique("fine")
+    files = [_upload("ok.txt", ok), _upload("old.doc", _unique("legacy")), _upload("empty.txt", b"   ")]
+
+    results = {r["filename"]: r for r in asyncio.run(_run_batch(files))}
+
+    assert results["ok.txt"]["success"]
+    assert not results["old.doc"]["success"]
+    assert "not supported" in results["old.doc"]["error"]
+    assert not results["empty.txt"]["success"]
+    assert "empty or unreadable" in results["empty.txt"]["error"]
+    assert calls["generate"] == [ok.decode()]
+
+
+def test_batch_rejects_too_many_files(calls, monkeypatch):
+    monkeypatch.setattr(summarizer, "MAX_BATCH_FILES", 2)
+    files = [_upload(f"{i}.txt", _unique(str(i))) for i in range(3)]
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(summarizer.summarize_batch(files, topic=None))
+
+    assert exc.value.status_code == 413
+    assert calls["extract"] == []
+
+
+def test_concurrent_extract_upload_shares_one_extraction(calls):
+    content = _unique("shared")
+    doc_id = document_hash(content)
+    start = threading.Barrier(4)
+    results = []
+
+    def worker():
+        start.wait()
+        results.append(summarizer._extract_upload("same.txt", content, doc_id))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [content.decode()] * 4
+    assert calls["extract"] == [content.decode()]
+    assert doc_id not in summarizer._inflight
+
+
+def test_cancelled_generate_keeps_slot_until_thread_returns(monkeypatch):
+    finished = threading.Event()
+
+    def slow_generate(text, topic=None, doc_id=None):
+        time.sleep(0.2)
+        finished.set()
+        return {}
+
+    monkeypatch.setattr(summarizer, "generate_summary_flashcards_quiz", slow_generate)
+
+    async def scenario():
+        monkeypatch.setattr(summarizer, "_llm_slots", asyncio.Semaphore(1))
+        task = asyncio.create_task(summarizer._generate("text", None, "doc"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.sleep(0.05)
+        held_after_cancel = summarizer._llm_slots.locked()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return held_after_cancel
+
+    assert asyncio.run(scenario())
+    assert finished.is_set()
+    assert not summarizer._llm_slots.locked()
@@ -5,6 +5,8 @@ from typing import Any, Dict, List
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from utils.retrieval import RETRIEVAL_TOKEN_BUDGET, get_or_build_index
+
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -55,6 +57,18 @@ USER_PROMPT_TEMPLATE = (
     "TEXT (truncated):\n{chunk}"
 )
 
+# Used when the caller asks about a specific topic/question; only the relevant passages are sent.
+FOCUSED_USER_PROMPT_TEMPLATE = (
+    "The student asked: \"{topic}\"\n"
+    "From the following passages of their document, produce the JSON as specified. "
+    "Focus the summary, flashcards, and quiz on that request; ignore unrelated material.\n"
+    "These are short excerpts, so the length rules above do NOT apply: write a summary of "
+    "roughly 150–350 words, scaled to how much the passages actually cover, and fewer "
+    "flashcards/quiz questions are fine. Use only what the passages support; do not pad "
+    "or add facts that are not in them.\n\n"
+    "PASSAGES:\n{chunk}"
+)
+
 # Second-pass expander if the first summary is too short.
 EXPAND_SYSTEM = (
     "You are an AI writing assistant. Return STRICT JSON with this exact schema:\n"
@@ -153,9 +167,29 @@ def _string_list(x: Any, lo: int = 0, hi: int | None = None) -> List[str]:
 
 # -------------------- Main generator --------------------
 
-def generate_summary_flashcards_quiz(text: str) -> Dict[str, Any]:
-    # keep within safe context
-    chunk = text[:20000]  # give the model a bit more to work with
+def generate_summary_flashcards_quiz(
+    text: str,
+    topic: str | None = None,
+    doc_id: str | None = None,
+) -> Dict[str, Any]:
+    """
+    With no topic, the head of the document is sent as before. With a topic/question,
+    the document's segments are ranked locally (BM25) and only the top passages within
+    RETRIEVAL_TOKEN_BUDGET are sent, in a single call with no expand pass. The segment
+    index is cached per doc_id, which must be the routes' document_hash() of the
+    uploaded bytes, so follow-up questions reuse it.
+    """
+    topic = (topic or "").strip()
+    if topic:
+        if not doc_id:
+            raise ValueError("doc_id is required for topic-focused requests.")
+        index = get_or_build_index(doc_id, text)
+        chunk = index.select(topic, RETRIEVAL_TOKEN_BUDGET)
+        user_prompt = FOCUSED_USER_PROMPT_TEMPLATE.format(topic=topic, chunk=chunk)
+    else:
+        # keep within safe context
+        chunk = text[:20000]  # give the model a bit more to work with
+        user_prompt = USER_PROMPT_TEMPLATE.format(chunk=chunk)
 
     resp = client.chat.completions.create(
         model=SUMMARY_MODEL,
@@ -164,7 +198,7 @@ def generate_summary_flashcards_quiz(text: str) -> Dict[str, Any]:
         response_format={"type": "json_object"},
         messages=[
             {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": USER_PROMPT_TEMPLATE.format(chunk=chunk)},
+            {"role": "user", "content": user_prompt},
         ],
     )
 
@@ -180,8 +214,9 @@ def generate_summary_flashcards_quiz(text: str) -> Dict[str, Any]:
         summary = str(summary or "")
     key_takeaways = _string_list(data.get("keyTakeaways", []), hi=10)
 
-    # If the summary is too short, run a second pass to expand it.
-    if len(summary.split()) < MIN_SUMMARY_WORDS:
+    # If the summary is too short, run a second pass to expand it. Focused requests only
+    # send a few passages, so a short summary is expected and stretching it would pad.
+    if not topic and len(summary.split()) < MIN_SUMMARY_WORDS:
         try:
             expand = client.chat.completions.create(
                 model=SUMMARY_MODEL,
@@ -0,0 +1,218 @@
+# utils/retrieval.py
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Rough prompt budget for document passages (~4 chars per token); well under the
+# 20k-char head that untargeted requests send
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "1500"))
+# At most this many segments per request, however much budget is left
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+# Drop segments scoring below this fraction of the best hit, so a term that
+# appears everywhere (e.g. "scheduling" in a scheduling deck) can't fill the prompt
+RETRIEVAL_MIN_SCORE_RATIO = float(os.getenv("RETRIEVAL_MIN_SCORE_RATIO", "0.35"))
+# Target size of one segment; slide text is split into short lines, so we pack them
+SEGMENT_CHARS = int(os.getenv("RETRIEVAL_SEGMENT_CHARS", "800"))
+# How many documents (text + lazily built index) to keep around for follow-up questions
+INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "32"))
+
+CHARS_PER_TOKEN = 4
+
+# BM25 parameters
+_K1 = 1.5
+_B = 0.75
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is", "it",
+    "me", "of", "on", "or", "quiz", "that", "the", "this", "to", "was", "what", "when",
+    "where", "which", "who", "why", "with", "about", "explain", "summarize", "tell",
+}
+
+
+def _tokenize(text: str) -> List[str]:
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        if tok in _STOPWORDS:
+            continue
+        # cheap plural folding so "schedulers" matches "scheduler"
+        if len(tok) > 4 and tok.endswith("s") and not tok.endswith("ss"):
+            tok = tok[:-1]
+        tokens.append(tok)
+    return tokens
+
+
+def _split_segments(text: str, max_chars: int = SEGMENT_CHARS) -> List[str]:
+    """Pack consecutive lines into segments of roughly max_chars, breaking on blank lines first."""
+    segments: List[str] = []
+    buf: List[str] = []
+    size = 0
+
+    def flush():
+        nonlocal buf, size
+        if buf:
+            segments.append("\n".join(buf).strip())
+        buf, size = [], 0
+
+    for block in re.split(r"\n\s*\n", text):
+        for line in block.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            # hard-wrap very long lines (e.g. PDF pages without newlines)
+            while len(line) > max_chars:
+                flush()
+                segments.append(line[:max_chars])
+                line = line[max_chars:]
+            if size + len(line) > max_chars:
+                flush()
+            buf.append(line)
+            size += len(line) + 1
+        if size >= max_chars // 2:
+            flush()
+    flush()
+    return [s for s in segments if s]
+
+
+@dataclass
+class DocumentIndex:
+    """Segments of one document plus the BM25 statistics needed to rank them."""
+    doc_id: str
+    text: str
+    segments: List[str]
+    term_freqs: List[Counter] = field(default_factory=list)
+    seg_lens: List[int] = field(default_factory=list)
+    doc_freq: Dict[str, int] = field(default_factory=dict)
+    avg_len: float = 0.0
+
+    @classmethod
+    def build(cls, doc_id: str, text: str) -> "DocumentIndex":
+        segments = _split_segments(text)
+        term_freqs = [Counter(_tokenize(s)) for s in segments]
+        doc_freq: Dict[str, int] = {}
+        for tf in term_freqs:
+            for term in tf:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+        seg_lens = [sum(tf.values()) for tf in term_freqs]
+        avg_len = (sum(seg_lens) / len(seg_lens)) if seg_lens else 0.0
+        return cls(doc_id, text, segments, term_freqs, seg_lens, doc_freq, avg_len)
+
+    def score(self, query: str) -> List[float]:
+        terms = set(_tokenize(query))
+        n = len(self.segments)
+        scores = [0.0] * n
+        if not terms or not n:
+            return scores
+        for term in terms:
+            df = self.doc_freq.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i, tf in enumerate(self.term_freqs):
+                f = tf.get(term)
+                if not f:
+                    continue
+                norm = _K1 * (1 - _B + _B * self.seg_lens[i] / (self.avg_len or 1))
+                scores[i] += idf * f * (_K1 + 1) / (f + norm)
+        return scores
+
+    def select(
+        self,
+        query: str,
+        token_budget: int = RETRIEVAL_TOKEN_BUDGET,
+        top_k: int = RETRIEVAL_TOP_K,
+        min_score_ratio: float = RETRIEVAL_MIN_SCORE_RATIO,
+    ) -> str:
+        """
+        Return up to top_k best-matching segments that fit the budget, in document order.
+        Segments scoring below min_score_ratio of the best hit are dropped.
+        Falls back to the head of the document if nothing matches the query.
+        """
+        char_budget = token_budget * CHARS_PER_TOKEN
+        scores = self.score(query)
+        best = max(scores, default=0.0)
+        if best <= 0:
+            return self.text[:char_budget]
+
+        cutoff = best * min_score_ratio
+        ranked = sorted(
+            (i for i, s in enumerate(scores) if s > 0 and s >= cutoff),
+            key=lambda i: scores[i],
+            reverse=True,
+        )
+
+        picked: List[int] = []
+        used = 0
+        for i in ranked:
+            if len(picked) >= top_k:
+                break
+            seg_len = len(self.segments[i]) + 2
+            if used + seg_len > char_budget:
+                continue
+            picked.append(i)
+            used += seg_len
+        return "\n\n".join(self.segments[i] for i in sorted(picked))
+
+
+def document_hash(data: bytes) -> str:
+    """Cache key for an upload: SHA-256 of the raw file bytes (not the extracted text)."""
+    return hashlib.sha256(data).hexdigest()
+
+
+# -------------------- Per-document cache --------------------
+# Plain uploads only store the extracted text; the BM25 index is built lazily on
+# the first topic/follow-up request for that document.
+
+@dataclass
+class _CachedDocument:
+    text: str
+    index: Optional[DocumentIndex] = None
+
+
+_cache: "OrderedDict[str, _CachedDocument]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _lookup(doc_id: str) -> Optional[_CachedDocument]:
+    # caller holds _cache_lock
+    entry = _cache.get(doc_id)
+    if entry is not None:
+        _cache.move_to_end(doc_id)
+    return entry
+
+
+def get_text(doc_id: str) -> Optional[str]:
+    with _cache_lock:
+        entry = _lookup(doc_id)
+        return entry.text if entry is not None else None
+
+
+def cache_text(doc_id: str, text: str) -> None:
+    with _cache_lock:
+        if _lookup(doc_id) is None:
+            _cache[doc_id] = _CachedDocument(text)
+        while len(_cache) > INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def get_or_build_index(doc_id: str, text: str) -> DocumentIndex:
+    with _cache_lock:
+        entry = _lookup(doc_id)
+        if entry is not None and entry.index is not None:
+            return entry.index
+
+    index = DocumentIndex.build(doc_id, text)
+    with _cache_lock:
+        entry = _lookup(doc_id)
+        if entry is None:
+            entry = _cache[doc_id] = _CachedDocument(text)
+        if entry.index is None:
+            entry.index = index
+        while len(_cache) > INDEX_CACHE_SIZE:
+            _cache.popitem(last=False)
+        return entry.index